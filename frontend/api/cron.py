@@ -1,107 +1,159 @@
 import datetime as dt
-import json
+import hashlib
+import hmac
 import os
 import re
+import urllib.parse
 import urllib3
 
+import orjson
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from selectolax.lexbor import LexborHTMLParser
 from http.server import BaseHTTPRequestHandler
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+SOURCE_URL = "https://sjsuparkingstatus.sjsu.edu/GarageStatusPlain"
+MAX_HTML_BYTES = 512 * 1024
 
-def fetch_html(url: str) -> str:
-    response = requests.get(url, timeout=10, verify=False)
-    response.raise_for_status()
-    return response.text
+GARAGE_NAMES = ["South Garage", "North Garage", "West Garage", "South Campus Garage"]
 
+_LAST_UPDATED_RE = re.compile(r"\bLast updated\b\s+(.+?)(?:\s+Refresh\b|$)", re.IGNORECASE)
+# Cheap pre-check on the raw bytes. It must accept anything that collapses to
+# "last updated" in the page text: whitespace (including non-ASCII spaces),
+# character entities such as &nbsp;, and tags between the two words.
+_LAST_UPDATED_BYTES_RE = re.compile(rb"last(?:[^a-z0-9<&]|&#?[a-z0-9]+;|<[^>]*>)+updated", re.IGNORECASE)
 
-def parse_last_updated(html: str) -> str | None:
-    soup = BeautifulSoup(html, "html.parser")
-    text = soup.get_text(" ", strip=True)
-    m = re.search(r"\bLast updated\b\s+(.+?)(?:\s+Refresh\b|$)", text, re.IGNORECASE)
+# One pass over the page text finds every garage: its name, then (without
+# running into another garage name) either "Full" or an "NN %" status.
+# Longer names go first so "South Campus Garage" is not read as "South Garage".
+_GARAGE_ALTERNATION = "|".join(re.escape(name) for name in sorted(GARAGE_NAMES, key=len, reverse=True))
+_GARAGE_STATUS_RE = re.compile(
+    rf"\b({_GARAGE_ALTERNATION})\b(?:(?!{_GARAGE_ALTERNATION}).){{0,400}}?(?:\b(?i:full)\b|\b(\d{{1,3}})\s*%)"
+)
+
+CRON_SECRET = os.getenv("CRON_SECRET")
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+SUPABASE_ENDPOINT = f"{SUPABASE_URL.rstrip('/')}/rest/v1/garage_status" if SUPABASE_URL else None
+SUPABASE_HEADERS = {
+    "apikey": SUPABASE_KEY,
+    "Authorization": f"Bearer {SUPABASE_KEY}",
+    "Content-Type": "application/json",
+    "Prefer": "return=minimal",
+}
+
+# (page digest, last_updated, statuses) from the most recent parse_page call.
+_PARSE_CACHE: tuple[bytes, str | None, dict[str, int]] | None = None
+
+_CRON_SECRET_BYTES = CRON_SECRET.encode("utf-8") if CRON_SECRET else b""
+_EXPECTED_BEARER = f"Bearer {CRON_SECRET}".encode("utf-8") if CRON_SECRET else b""
+
+
+class _UnverifiedAdapter(HTTPAdapter):
+    """HTTPAdapter that skips TLS verification for the hosts it is mounted on."""
+    
+    def send(self, request, **kwargs):
+        kwargs["verify"] = False
+        return super().send(request, **kwargs)
+
+
+# Only the garage status host is fetched without certificate verification;
+# Supabase requests stay verified.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+_SESSION.mount("https://sjsuparkingstatus.sjsu.edu/", _UnverifiedAdapter(pool_connections=1, pool_maxsize=1))
+_SESSION.headers.update({"User-Agent": "sjsuparking-cron"})
+
+
+def fetch_html(url: str) -> bytes:
+    with _SESSION.get(url, timeout=10, stream=True) as response:
+        response.raise_for_status()
+        html = response.raw.read(MAX_HTML_BYTES + 1, decode_content=True)
+    if len(html) > MAX_HTML_BYTES:
+        raise requests.RequestException(f"Garage status page exceeds {MAX_HTML_BYTES} bytes")
+    return html
+
+
+def _make_tree(html: bytes) -> LexborHTMLParser:
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(["script", "style"])
+    return tree
+
+
+def _page_text(tree: LexborHTMLParser) -> str:
+    if tree.body is None:
+        return ""
+    return " ".join(tree.body.text(separator=" ").split())
+
+
+def _mentions_last_updated(html: bytes) -> bool:
+    return _LAST_UPDATED_BYTES_RE.search(html) is not None
+
+
+def _last_updated_from_text(text: str) -> str | None:
+    m = _LAST_UPDATED_RE.search(text)
     if not m:
         return None
     return m.group(1).strip()
 
 
-def parse_statuses(html: str) -> dict[str, int]:
-    soup = BeautifulSoup(html, "html.parser")
+def _statuses_from_text(text: str) -> dict[str, int]:
     statuses = {}
-    garage_names = ["South Garage", "North Garage", "West Garage", "South Campus Garage"]
     
-    for garage_name in garage_names:
-        heading = soup.find("h2", string=lambda t: t and garage_name in t.strip())
-        if not heading:
-            continue
-        
-        parent = heading.parent
-        if not parent:
+    for match in _GARAGE_STATUS_RE.finditer(text):
+        garage_name = match.group(1)
+        if garage_name in statuses:
             continue
-        
-        parent_text = parent.get_text()
-        
-        garage_pattern = re.escape(garage_name.strip())
-        
-        pattern = rf"{garage_pattern}.*?(?:\d+\s+[SNWE].*?)?\s+(Full|\d+\s*%)"
-        match = re.search(pattern, parent_text, re.IGNORECASE | re.DOTALL)
-        
-        if match:
-            status_text = match.group(1).strip()
-            if "Full" in status_text or status_text.lower() == "full":
-                statuses[garage_name] = 100
-            elif "%" in status_text:
-                try:
-                    number_str = status_text.replace("%", "").strip()
-                    statuses[garage_name] = int(number_str)
-                except ValueError:
-                    continue
+        percent = match.group(2)
+        statuses[garage_name] = int(percent) if percent else 100
     
     return statuses
 
 
-def send_to_supabase(
-    *,
-    source_url: str,
-    fetched_at: str,
-    last_updated: str | None,
-    statuses: dict[str, int],
-) -> tuple[int, str | None]:
+def parse_page(html: bytes) -> tuple[str | None, dict[str, int]]:
     """
-    Send statuses to Supabase.
-    Returns tuple of (inserted_count, error_message).
+    Parse the garage status page once.
+    Returns tuple of (last_updated, statuses).
+    Repeat fetches of an identical page reuse the previous parse.
     """
-    supabase_url = os.getenv("SUPABASE_URL")
-    supabase_key = os.getenv("SUPABASE_KEY")
+    global _PARSE_CACHE
     
-    if not supabase_url or not supabase_key:
-        return (0, "SUPABASE_URL or SUPABASE_KEY not set")
+    digest = hashlib.blake2b(html, digest_size=16).digest()
+    if _PARSE_CACHE is not None and _PARSE_CACHE[0] == digest:
+        return (_PARSE_CACHE[1], dict(_PARSE_CACHE[2]))
     
-    endpoint = f"{supabase_url.rstrip('/')}/rest/v1/garage_status"
+    text = _page_text(_make_tree(html))
+    last_updated = _last_updated_from_text(text) if _mentions_last_updated(html) else None
+    statuses = _statuses_from_text(text)
+    _PARSE_CACHE = (digest, last_updated, statuses)
+    return (last_updated, dict(statuses))
+
+
+def parse_last_updated(html: bytes) -> str | None:
+    if not _mentions_last_updated(html):
+        return None
+    return _last_updated_from_text(_page_text(_make_tree(html)))
+
+
+def parse_statuses(html: bytes) -> dict[str, int]:
+    return _statuses_from_text(_page_text(_make_tree(html)))
+
+
+def send_to_supabase(*, rows: list[dict]) -> tuple[int, str | None]:
+    """
+    Send garage_status rows to Supabase.
+    Returns tuple of (inserted_count, error_message).
+    """
+    if not SUPABASE_ENDPOINT or not SUPABASE_KEY:
+        return (0, "SUPABASE_URL or SUPABASE_KEY not set")
     
-    rows = [
-        {
-            "fetched_at": fetched_at,
-            "last_updated": last_updated,
-            "garage": garage,
-            "status": status,
-            "source_url": source_url,
-        }
-        for garage, status in statuses.items()
-    ]
     if not rows:
         return (0, None)
     
-    headers = {
-        "apikey": supabase_key,
-        "Authorization": f"Bearer {supabase_key}",
-        "Content-Type": "application/json",
-        "Prefer": "return=minimal",
-    }
-    
     try:
-        resp = requests.post(endpoint, headers=headers, json=rows, timeout=10)
+        resp = _SESSION.post(SUPABASE_ENDPOINT, headers=SUPABASE_HEADERS, data=orjson.dumps(rows), timeout=10)
         resp.raise_for_status()
         return (len(rows), None)
     except requests.RequestException as e:
@@ -114,89 +166,73 @@ def send_to_supabase(
         return (0, error_msg)
 
 
-def get_request_token(query_params: dict) -> str | None:
+def get_request_token(query_params: dict[str, list[str]]) -> str | None:
     """Extract token from query parameters."""
     token = query_params.get("token")
-    if isinstance(token, list):
-        return token[0] if token else None
-    return token
-
-
-def parse_query_string(query_string: str) -> dict:
-    """Parse query string into a dictionary."""
-    params = {}
-    if not query_string:
-        return params
-    for pair in query_string.split("&"):
-        if "=" in pair:
-            key, value = pair.split("=", 1)
-            if key in params:
-                if not isinstance(params[key], list):
-                    params[key] = [params[key]]
-                params[key].append(value)
-            else:
-                params[key] = value
-    return params
+    return token[0] if token else None
+
+
+def parse_query_string(query_string: str) -> dict[str, list[str]]:
+    """Parse query string into a dictionary of value lists."""
+    # parse_qs decodes "+" as a space; escape it first so a literal "+" in the
+    # token still matches the secret.
+    return urllib.parse.parse_qs(query_string.replace("+", "%2B"), keep_blank_values=True)
 
 
 class handler(BaseHTTPRequestHandler):
+    # Buffer wfile so the status line, headers and body go out in one flush.
+    wbufsize = -1
+    
     def do_GET(self):
         self.handle_request()
     
     def do_HEAD(self):
         self.handle_request()
     
+    def _reply(self, code: int, obj: dict, headers: dict[str, str] | None = None) -> None:
+        """Send a JSON response with the given status code."""
+        body = orjson.dumps(obj)
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
     def handle_request(self):
         """Handle the cron job request."""
         # Check HTTP method
         if self.command not in ("GET", "HEAD"):
-            self.send_response(405)
-            self.send_header("Allow", "GET, HEAD")
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": "Method not allowed"}).encode("utf-8"))
-            return
+            return self._reply(405, {"error": "Method not allowed"}, headers={"Allow": "GET, HEAD"})
         
         # Check CRON_SECRET
-        cron_secret = os.getenv("CRON_SECRET")
-        if not cron_secret:
-            self.send_response(500)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": "CRON_SECRET is not set in the environment"}).encode("utf-8"))
-            return
+        if not CRON_SECRET:
+            return self._reply(500, {"error": "CRON_SECRET is not set in the environment"})
         
         # Check authentication
         auth_header = self.headers.get("Authorization", "")
-        query_string = self.path.split("?")[1] if "?" in self.path else ""
+        query_string = urllib.parse.urlsplit(self.path).query
         query_params = parse_query_string(query_string)
         token = get_request_token(query_params)
         
-        authed = auth_header == f"Bearer {cron_secret}" or token == cron_secret
+        authed = bool(CRON_SECRET) and (
+            hmac.compare_digest(auth_header.encode("utf-8"), _EXPECTED_BEARER)
+            or (token is not None and hmac.compare_digest(token.encode("utf-8"), _CRON_SECRET_BYTES))
+        )
         if not authed:
-            self.send_response(401)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": "Unauthorized"}).encode("utf-8"))
-            return
+            return self._reply(401, {"error": "Unauthorized"})
         
         # Check Supabase environment variables
-        supabase_url = os.getenv("SUPABASE_URL")
-        supabase_key = os.getenv("SUPABASE_KEY")
-        if not supabase_url or not supabase_key:
-            self.send_response(500)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": "SUPABASE_URL or SUPABASE_KEY is not set"}).encode("utf-8"))
-            return
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            return self._reply(500, {"error": "SUPABASE_URL or SUPABASE_KEY is not set"})
         
-        source_url = "https://sjsuparkingstatus.sjsu.edu/GarageStatusPlain"
+        source_url = SOURCE_URL
         
         try:
             # Fetch and parse HTML
             html = fetch_html(source_url)
-            last_updated = parse_last_updated(html)
-            statuses = parse_statuses(html)
+            last_updated, statuses = parse_page(html)
             fetched_at = dt.datetime.now(dt.timezone.utc).isoformat()
             
             # Prepare rows
@@ -213,72 +249,45 @@ class handler(BaseHTTPRequestHandler):
             
             # If no statuses parsed, return early
             if len(rows) == 0:
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                response = {
+                return self._reply(200, {
                     "ok": True,
                     "inserted": 0,
                     "fetchedAt": fetched_at,
                     "lastUpdated": last_updated,
                     "statuses": statuses,
                     "note": "No statuses parsed; nothing inserted",
-                }
-                self.wfile.write(json.dumps(response).encode("utf-8"))
-                return
+                })
             
             # Send to Supabase
-            inserted, error = send_to_supabase(
-                source_url=source_url,
-                fetched_at=fetched_at,
-                last_updated=last_updated,
-                statuses=statuses,
-            )
+            inserted, error = send_to_supabase(rows=rows)
             
             if error:
-                self.send_response(502)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                response = {
+                return self._reply(502, {
                     "error": "Supabase insert failed",
                     "message": error,
                     "fetchedAt": fetched_at,
                     "lastUpdated": last_updated,
                     "statuses": statuses,
-                }
-                self.wfile.write(json.dumps(response).encode("utf-8"))
-                return
+                })
             
             # Success response
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            response = {
+            self._reply(200, {
                 "ok": True,
                 "inserted": inserted,
                 "fetchedAt": fetched_at,
                 "lastUpdated": last_updated,
                 "statuses": statuses,
-            }
-            self.wfile.write(json.dumps(response).encode("utf-8"))
+            })
             
         except requests.RequestException as e:
             message = str(e)
-            self.send_response(502)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            response = {
+            self._reply(502, {
                 "error": "Failed to fetch garage status page",
                 "message": message,
-            }
-            self.wfile.write(json.dumps(response).encode("utf-8"))
+            })
         except Exception as e:
             message = str(e)
-            self.send_response(500)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            response = {
+            self._reply(500, {
                 "error": "Cron failed",
                 "message": message,
-            }
-            self.wfile.write(json.dumps(response).encode("utf-8"))
+            })